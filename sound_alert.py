@@ -1,12 +1,18 @@
 import sys
 import os
 import argparse
+import math
+import queue
 import time
+import threading
+from fractions import Fraction
 import sounddevice as sd
 import numpy as np
 import simpleaudio as sa
-import torch
-from silero_vad import get_speech_timestamps, load_silero_vad
+
+# Cache compiled Numba kernels on disk so later starts load them instead of compiling
+os.environ.setdefault("NUMBA_CACHE_DIR", ".numba_cache")
+from numba import njit  # noqa: E402
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(
@@ -47,8 +53,157 @@ parser.add_argument(
     default=1000,
     help="Length of each audio frame in milliseconds.",
 )
+parser.add_argument(
+    "-b",
+    "--backend",
+    type=str,
+    choices=["rms", "webrtc", "silero"],
+    default="silero",
+    help="Speech detection backend ('rms' disables speech detection).",
+)
+parser.add_argument(
+    "--cuda",
+    action="store_true",
+    help="Run the silero backend on the GPU (requires onnxruntime-gpu).",
+)
 args = parser.parse_args()
 
+# Int8-quantized Silero-VAD v5 ONNX model, consumed in fixed windows with a persistent state
+VAD_MODEL_PATH = os.path.join("models", "silero_vad.int8.onnx")
+VAD_WINDOW = 512  # samples per inference at 16 kHz
+VAD_CONTEXT = 64  # trailing samples of the previous window prepended to each input
+SPEECH_PROBABILITY = 0.5
+VAD_PROVIDERS = ["CPUExecutionProvider"]
+if args.cuda:
+    VAD_PROVIDERS.insert(0, "CUDAExecutionProvider")
+
+WEBRTC_FRAME = 30  # WebRTC VAD frame length in milliseconds (10, 20 or 30)
+WEBRTC_MODE = 3  # WebRTC VAD aggressiveness (0 to 3)
+
+RING_SIZE = 8  # audio blocks buffered between the input callback and the worker
+PRINT_INTERVAL = 100  # minimum time in milliseconds between status line updates
+STATUS_LINE = b"\rCurrent Noise Level: %.3f | %d%% of threshold %s"
+
+
+@njit(
+    "Tuple((float64, boolean, boolean))(int16[::1], float64, float64)",
+    cache=True,
+    fastmath=True,
+    boundscheck=False,
+)
+def _gate(buf, thr2, speech_thr2):
+    """Compute the mean square of an int16 buffer (in raw int16² units) in a single pass
+    and compare it against the squared noise and speech thresholds."""
+    n = buf.shape[0]
+    s = 0.0
+    for i in range(n):
+        s += np.float64(buf[i]) * np.float64(buf[i])
+    ms = s / n
+    return ms, ms > thr2, ms > speech_thr2
+
+
+class SileroVAD:
+    """Silero-VAD v5 ONNX model run through ONNX Runtime."""
+
+    def __init__(self, sample_rate, block_size):
+        import onnxruntime as ort
+
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = 1
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.sess = ort.InferenceSession(
+            VAD_MODEL_PATH, providers=VAD_PROVIDERS, sess_options=so
+        )
+        # Model input, reused across windows: previous context followed by the window
+        self._vad_in = np.zeros((1, VAD_CONTEXT + VAD_WINDOW), dtype=np.float32)
+        self.sr = np.array(sample_rate, dtype=np.int64)
+        # Normalized samples, starting with the leftover of the previous block
+        self._f32 = np.empty(block_size + VAD_WINDOW, dtype=np.float32)
+        self._pending = 0
+        # Hot-path bindings: the session's run method and a persistent input feed,
+        # which also holds the model state between windows
+        self._run = self.sess.run
+        self._zero_state = np.zeros((2, 1, 128), dtype=np.float32)
+        self._feed = {"input": self._vad_in, "state": self._zero_state, "sr": self.sr}
+
+    def is_speech(self, block):
+        """Check if the audio block contains speech.
+
+        Samples that do not fill a whole window are kept for the next block,
+        so consecutive blocks are seen as a continuous stream."""
+        audio = self._f32
+        end = self._pending + len(block)
+        np.multiply(
+            block,
+            np.float32(1 / 32768.0),
+            out=audio[self._pending : end],
+            dtype=np.float32,
+        )
+
+        run, feed, vad_in = self._run, self._feed, self._vad_in
+        speech = False
+        for start in range(0, end - VAD_WINDOW + 1, VAD_WINDOW):
+            vad_in[0, VAD_CONTEXT:] = audio[start : start + VAD_WINDOW]
+            prob, feed["state"] = run(None, feed)
+            vad_in[0, :VAD_CONTEXT] = vad_in[0, -VAD_CONTEXT:]
+            if prob.item() > SPEECH_PROBABILITY:
+                speech = True
+
+        done = end - end % VAD_WINDOW
+        self._pending = end - done
+        audio[: self._pending] = audio[done:end]
+        return speech
+
+    def reset(self):
+        """Forget the leftover samples, context and model state after a gap."""
+        self._pending = 0
+        self._vad_in[:] = 0.0
+        self._feed["state"] = self._zero_state
+
+
+class WebRTCVAD:
+    """WebRTC VAD run over fixed-length frames."""
+
+    def __init__(self, sample_rate, block_size):
+        import webrtcvad
+
+        self.vad = webrtcvad.Vad(WEBRTC_MODE)
+        # Hot-path bindings: the bound is_speech method and a constant sample rate
+        self._is_speech = self.vad.is_speech
+        self._sr_const = int(sample_rate)
+        self.frame_size = sample_rate * WEBRTC_FRAME // 1000
+        # Raw int16 bytes, starting with the leftover of the previous block
+        self._buf = memoryview(bytearray(2 * (block_size + self.frame_size)))
+        self._pending = 0
+
+    def is_speech(self, block):
+        """Check if the audio block contains speech.
+
+        Bytes that do not fill a whole frame are kept for the next block,
+        so consecutive blocks are seen as a continuous stream."""
+        buf = self._buf
+        end = self._pending + block.nbytes
+        buf[self._pending : end] = memoryview(block).cast("B")
+
+        is_speech, sr, n = self._is_speech, self._sr_const, 2 * self.frame_size
+        speech = False
+        for start in range(0, end - n + 1, n):
+            if is_speech(buf[start : start + n], sr):
+                speech = True
+
+        done = end - end % n
+        self._pending = end - done
+        buf[: self._pending] = buf[done:end]
+        return speech
+
+    def reset(self):
+        """Forget the leftover bytes after a gap."""
+        self._pending = 0
+
+
+# Speech detection backends, imported lazily when instantiated
+VAD_BACKENDS = {"rms": None, "webrtc": WebRTCVAD, "silero": SileroVAD}
+
 
 class SoundAlerter:
     def __init__(
@@ -57,71 +212,194 @@ class SoundAlerter:
         speech_threshold,
         alarm_wave,
         alarm_duration,
+        block_size,
         sample_rate=16000,
+        input_rate=None,
+        backend="silero",
     ):
         self.threshold = threshold
         self.speech_threshold = speech_threshold
+        # Squared thresholds in raw int16² units, compared against the mean square
+        self._thr2 = threshold * threshold * 32768.0**2
+        self._speech_thr2 = speech_threshold * speech_threshold * 32768.0**2
         self.alarm_wave = alarm_wave
         self.alarm_duration = int(alarm_duration * 1000)
+        self._cooldown_ns = int(alarm_duration * 2 * 1e9)
 
         self.alarm_active = False
-        self.last_alarm_time = 0
+        self.last_alarm_ns = 0
 
-        # Initialize VAD (Voice Activity Detection)
+        # The alarm PCM is cached once and played on a dedicated thread
+        self._alarm_pcm = alarm_wave.audio_data
+        self._alarm_length = len(self._alarm_pcm) / (
+            alarm_wave.num_channels * alarm_wave.bytes_per_sample * alarm_wave.sample_rate
+        )
+        self._play_obj = None
+        self._alarm_q = queue.Queue(maxsize=1)
+        self.player = threading.Thread(target=self._player, daemon=True)
+        self.player.start()
+
+        # Resample the captured blocks if the device could not record at sample_rate
         self.sample_rate = sample_rate
-        self.vad = load_silero_vad()
+        self.input_rate = input_rate or sample_rate
+        self._taps = None
+        vad_block_size = block_size
+        if self.input_rate != sample_rate:
+            from scipy.signal import firwin, upfirdn
+
+            ratio = Fraction(sample_rate, self.input_rate).limit_denominator(1000)
+            self._up, self._down = ratio.as_integer_ratio()
+            # Same anti-aliasing filter resample_poly designs by default, built once
+            max_rate = max(self._up, self._down)
+            self._taps = self._up * firwin(
+                20 * max_rate + 1, 1 / max_rate, window=("kaiser", 5.0)
+            )
+            self._upfirdn = upfirdn
+            # Input history covering the filter span, plus room to align it to `down`
+            self._history = np.zeros(
+                -(-len(self._taps) // self._up) + self._down, dtype=np.float64
+            )
+            self._samples_in = 0
+            self._samples_out = 0
+            vad_block_size = -(-block_size * self._up // self._down)
+
+        # Initialize VAD (Voice Activity Detection)
+        vad_cls = VAD_BACKENDS[backend]
+        self.vad = vad_cls(sample_rate, vad_block_size) if vad_cls else None
+        self._vad_fn = self.vad.is_speech if self.vad else None
+
+        # Blocks are handed from the audio callback to the worker thread via a ring buffer
+        self.ring = np.empty((RING_SIZE, block_size), dtype=np.int16)
+        self.w_idx = 0
+        self.r_idx = 0
+        self.sem = threading.Semaphore(0)  # filled slots
+        self.free = threading.Semaphore(RING_SIZE)  # slots the callback may write
+        self._print_interval_ns = PRINT_INTERVAL * 1_000_000
+        self._last_print_ns = 0
+        self.worker = threading.Thread(target=self._consumer, daemon=True)
+        self.worker.start()
 
     def trigger_alarm(self, message):
-        """Play the alarm sound."""
+        """Queue the alarm sound for playback."""
 
-        current_time = time.time()
-        if (
-            not self.alarm_active
-            and (current_time - self.last_alarm_time) * 1000 >= self.alarm_duration * 2
-        ):
+        now = time.monotonic_ns()
+        if not self.alarm_active and now - self.last_alarm_ns >= self._cooldown_ns:
             # Print the message
             sys.stdout.write(message)
             sys.stdout.flush()
-            # Play the alarm sound
-            alarm = self.alarm_wave.play()
+            # Hand the alarm over to the playback thread
             self.alarm_active = True
-            self.last_alarm_time = current_time
-            alarm.wait_done()
-            # Reset alarm after a delay
-            sd.sleep(self.alarm_duration)
-            self.alarm_active = False
-
-    def is_speech(self, audio_data):
-        """Check if the audio data contains speech."""
-        speech_timesteps = get_speech_timestamps(
-            audio_data, self.vad, return_seconds=True
-        )
-        return len(speech_timesteps) > 0
+            self.last_alarm_ns = now
+            try:
+                self._alarm_q.put_nowait(True)
+            except queue.Full:
+                pass
+
+    def _player(self):
+        """Playback loop for alarms queued by trigger_alarm."""
+        while True:
+            self._alarm_q.get()
+            try:
+                self._play_obj = sa.play_buffer(
+                    self._alarm_pcm,
+                    self.alarm_wave.num_channels,
+                    self.alarm_wave.bytes_per_sample,
+                    self.alarm_wave.sample_rate,
+                )
+            except Exception as e:
+                # Keep the thread alive and still reset the alarm after the delay
+                print(f"\nError: could not play alarm: {e}", flush=True)
+            # Reset alarm once it has played and the delay has passed
+            timer = threading.Timer(
+                self._alarm_length + self.alarm_duration / 1000, self._reset_alarm
+            )
+            timer.daemon = True
+            timer.start()
+
+    def _reset_alarm(self):
+        """Allow the alarm to be triggered again."""
+        self.alarm_active = False
 
     def check_sound_level(self, indata, frames, time, status):
-        """Callback function to process audio input."""
+        """Callback function to copy audio input into the ring buffer."""
         if status:
-            print(f"Error: {status}")
+            print(f"Error: {status}", flush=True)
+
+        # Drop the block instead of overwriting one the worker has not processed yet
+        if not self.free.acquire(blocking=False):
+            print("Error: audio buffer overflow, dropping block", flush=True)
+            return
+
+        self.ring[self.w_idx] = np.frombuffer(indata, dtype=np.int16, count=frames)
+        self.w_idx = (self.w_idx + 1) % RING_SIZE
+        self.sem.release()
+
+    def _consumer(self):
+        """Worker loop processing the blocks queued by the audio callback."""
+        while True:
+            self.sem.acquire()
+            block = self.ring[self.r_idx]
+            if self._taps is not None:
+                block = self.resample(block)
+            self.process_block(block)
+            self.r_idx = (self.r_idx + 1) % RING_SIZE
+            self.free.release()
+
+    def resample(self, block):
+        """Resample a captured block from the input rate to the VAD sample rate.
+
+        The filter runs over the previous samples kept in the history, so block
+        boundaries are filtered exactly as if the stream was resampled at once."""
+        up, down, history = self._up, self._down, self._history
+        n_in, n_block = self._samples_in, len(block)
 
-        # Compute RMS (root mean square) level of the sound input
-        normalized_data = indata / 32768.0
-        rms_level = np.sqrt(np.mean(normalized_data**2))
-        percentage = min(100, int((rms_level / self.threshold) * 100))
+        # Start the filter input at a multiple of `down`, so its output phase
+        # lines up with the output samples of the whole stream
+        start = (n_in - len(history) + down) // down * down
+        x = np.concatenate((history[start - n_in :], block))
+        y = self._upfirdn(self._taps, x, up, down)
 
-        suffix = "(ALARM!)" if percentage >= 100 else " " * 10
-        sys.stdout.write(
-            f"\rCurrent Noise Level: {rms_level:.3f} | {percentage}% of threshold {suffix}"
+        # Keep only the outputs that are complete and not returned before
+        offset = start * up // down
+        end = -(-(n_in + n_block) * up // down)
+        resampled = y[self._samples_out - offset : end - offset]
+        self._samples_in += n_block
+        self._samples_out = end
+
+        if n_block >= len(history):
+            history[:] = block[-len(history) :]
+        else:
+            history[:-n_block] = history[n_block:]
+            history[-n_block:] = block
+        return np.clip(resampled, -32768, 32767).astype(np.int16)
+
+    def process_block(self, block):
+        """Check the sound level of an audio block and trigger alarms."""
+        # Compute the mean square of the sound input, RMS is only needed for display
+        mean_square, over_noise, over_speech = _gate(
+            block, self._thr2, self._speech_thr2
         )
-        sys.stdout.flush()
 
-        if rms_level > self.threshold:
+        now = time.monotonic_ns()
+        if now - self._last_print_ns >= self._print_interval_ns:
+            self._last_print_ns = now
+            rms_level = math.sqrt(mean_square) / 32768.0
+            percentage = min(100, int((rms_level / self.threshold) * 100))
+
+            suffix = b"(ALARM!)" if percentage >= 100 else b" " * 10
+            os.write(1, STATUS_LINE % (rms_level, percentage, suffix))
+
+        if over_noise:
             self.trigger_alarm("\nNoise level exceeded threshold! (ALARM!)\n")
 
         # Speech recognition
-        if rms_level > self.speech_threshold:
-            audio_data = torch.tensor(normalized_data[:, 0], dtype=torch.float32)
-            if self.is_speech(audio_data):
-                self.trigger_alarm("\nSpeech level exceeded threshold! (ALARM!)\n")
+        if self.vad is not None:
+            if over_speech:
+                if self._vad_fn(block):
+                    self.trigger_alarm("\nSpeech level exceeded threshold! (ALARM!)\n")
+            else:
+                # Skipped blocks break the stream, so the VAD must not carry history
+                self.vad.reset()
 
 
 # Load the alarm sound
@@ -132,24 +410,45 @@ except FileNotFoundError:
     print(f"Error: Alarm file '{args.alarm_file}' not found.")
     sys.exit(1)
 
+# Check that the Silero-VAD model is present before building the session
+if args.backend == "silero" and not os.path.exists(VAD_MODEL_PATH):
+    print(
+        f"Error: Silero-VAD model '{VAD_MODEL_PATH}' not found. "
+        "See README.md, or select another backend with --backend."
+    )
+    sys.exit(1)
+
 SAMPLE_RATE = 16000
+# Record at the device's native rate if it does not support SAMPLE_RATE
+try:
+    sd.check_input_settings(channels=1, dtype="int16", samplerate=SAMPLE_RATE)
+    input_rate = SAMPLE_RATE
+except sd.PortAudioError:
+    input_rate = int(sd.query_devices(kind="input")["default_samplerate"])
+blocks_size = int(input_rate * args.frame_length / 1000)
 alerter = SoundAlerter(
-    args.threshold, args.speech_threshold, alarm_wave_, args.alarm_duration, SAMPLE_RATE
+    args.threshold,
+    args.speech_threshold,
+    alarm_wave_,
+    args.alarm_duration,
+    blocks_size,
+    SAMPLE_RATE,
+    input_rate,
+    args.backend,
 )
-blocks_size = int(SAMPLE_RATE * args.frame_length / 1000)
 
 try:
-    print("Monitoring sound levels... Press Ctrl+C to stop.")
-    with sd.InputStream(
+    print("Monitoring sound levels... Press Ctrl+C to stop.", flush=True)
+    with sd.RawInputStream(
         callback=alerter.check_sound_level,
         channels=1,
-        samplerate=SAMPLE_RATE,
+        samplerate=input_rate,
         dtype="int16",
         blocksize=blocks_size,
     ):
         while True:
             sd.sleep(100)  # Keep the stream alive, check every 100ms
 except KeyboardInterrupt:
-    print("\nExiting...")
+    print("\nExiting...", flush=True)
 finally:
     print("Stopping audio stream. Goodbye!")